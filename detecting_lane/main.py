@@ -60,7 +60,7 @@ class LaneDataset(VisionDataset):
         label = self.img_labels[idx]
 
         return [
-            torch.clone(img),
+            torch.from_numpy(img),
             torch.tensor(label, dtype=torch.long),
         ]
 
@@ -4,6 +4,7 @@ import os
 from time import time
 from typing import Any, Callable, Optional
 
+import numpy as np
 import pandas as pd
 
 import torch
@@ -11,24 +12,29 @@ from torch.utils.data import DataLoader, random_split
 import torchvision
 from torchvision import models
 from torchvision.datasets import VisionDataset
-from torchvision.transforms import Resize, Normalize, ToTensor, CenterCrop
+from torchvision.transforms import v2
 
 import cv2
 from PIL import Image
 
 import pytorch_lightning as pl
-from pytorch_lightning.callbacks import EarlyStopping, ModelCheckpoint, QuantizationAwareTraining
+from pytorch_lightning.callbacks import EarlyStopping, ModelCheckpoint
 from pytorch_lightning.loggers import CSVLogger
 
+from torchao.quantization import quantize_, Int8DynamicActivationInt8WeightConfig
+
 import torch
 
 torch.backends.quantized.engine = 'qnnpack'
+torch.set_float32_matmul_precision('high')
+torch.backends.cudnn.benchmark = True
 
 
+QUANTIZE = False
 BATCH_SIZE = 128
 NUM_EPOCHS = 50
 LEARNING_RATE = 0.01
-NUM_WORKERS = 4
+NUM_WORKERS = min(8, os.cpu_count())
 FEATURES = 43
 
 """
@@ -67,6 +73,73 @@ class DataSet(Dataset):
  """
 
 
+IMG_SIZE = 32
+
+
+def build_cache(root, train=True):
+    """decode + crop + resize every image once into a uint8 memmap"""
+    if train:
+        folder_name = "Train"
+    else:
+        folder_name = "Test"
+
+    cache_file = os.path.join(root, folder_name + '_cache.npy')
+    labels_file = os.path.join(root, folder_name + '_labels.npy')
+    if os.path.exists(cache_file) and os.path.exists(labels_file):
+        return
+
+    df = pd.read_csv(os.path.join(root, folder_name + '.csv'))
+    """
+    Width
+    Height
+    Roi.X1
+    Roi.Y1
+    Roi.X2
+    Roi.Y2
+    ClassId
+    Path
+    """
+    n = df.shape[0]
+    images = np.memmap(cache_file, dtype=np.uint8, mode='w+',
+                       shape=(n, IMG_SIZE, IMG_SIZE, 3))
+
+    # plain numpy arrays, .iloc per row is way too slow here
+    paths = df['Path'].to_numpy()
+    x1 = df['Roi.X1'].to_numpy()
+    y1 = df['Roi.Y1'].to_numpy()
+    x2 = df['Roi.X2'].to_numpy()
+    y2 = df['Roi.Y2'].to_numpy()
+    labels = df['ClassId'].to_numpy(dtype=np.int64)
+
+    # JPEGs decode on the GPU's nvJPEG hardware when there is one;
+    # anything else (PNG, no CUDA) takes the cv2 path
+    use_gpu_decode = torch.cuda.is_available()
+
+    for i in range(n):
+        path = os.path.join(root, paths[i])
+        if use_gpu_decode:
+            try:
+                data = torchvision.io.read_file(path)
+                img = torchvision.io.decode_jpeg(
+                    data, mode=torchvision.io.ImageReadMode.RGB,
+                    device='cuda')
+                img = img[:, y1[i]: y2[i], x1[i]: x2[i]]  # crop image
+                img = v2.functional.resize(
+                    img, (IMG_SIZE, IMG_SIZE), antialias=True)
+                images[i] = img.permute(1, 2, 0).cpu().numpy()
+                continue
+            except RuntimeError:
+                pass
+        img = cv2.imread(path)
+        img = img[y1[i]: y2[i], x1[i]: x2[i], :]  # crop image
+        img = cv2.resize(img, (IMG_SIZE, IMG_SIZE),
+                         interpolation=cv2.INTER_AREA)
+        images[i] = img[:, :, ::-1]  # convert bgr into rgb
+
+    images.flush()
+    np.save(labels_file, labels)
+
+
 class TrafficSignDataset(VisionDataset):
     """meowmeowmeowmeowmeow/gtsrb-german-traffic-sign"""
 
@@ -83,41 +156,20 @@ class TrafficSignDataset(VisionDataset):
         else:
             folder_name = "Test"
 
-        self.csv_data = pd.read_csv(
-            os.path.join(self.root, folder_name + '.csv'))
-        """
-        Width
-        Height
-        Roi.X1
-        Roi.Y1
-        Roi.X2
-        Roi.Y2
-        ClassId
-        Path
-        """
+        self.labels = np.load(
+            os.path.join(self.root, folder_name + '_labels.npy'))
+        self.images = np.memmap(
+            os.path.join(self.root, folder_name + '_cache.npy'),
+            dtype=np.uint8, mode='r',
+            shape=(self.labels.shape[0], IMG_SIZE, IMG_SIZE, 3))
 
     def __len__(self) -> int:
-        return self.csv_data.shape[0]
+        return self.labels.shape[0]
 
     def __getitem__(self, index: int) -> Any:
-        d = self.csv_data.iloc[index]
-        data = {
-            "width": d["Width"],
-            "height": d["Height"],
-            "x1":  d["Roi.X1"],
-            "y1": d["Roi.Y1"],
-            "x2": d["Roi.X2"],
-            "y2": d["Roi.Y2"],
-            "cid": d["ClassId"],
-            "path": d["Path"],
-        }
-        img = cv2.imread(os.path.join(self.root, data['path']))
-        img = img[data['y1']: data['y2'],
-                  data['x1']: data['x2'], :]  # crop image
-        img = img[:, :, ::-1]  # convert bgr into rgb
-        img = Image.fromarray(img)
-
-        target = data['cid']
+        img = torch.from_numpy(self.images[index].copy())
+        img = img.permute(2, 0, 1)  # HWC -> CHW
+        target = self.labels[index]
 
         if self.transform is not None:
             img = self.transform(img)
@@ -126,11 +178,29 @@ class TrafficSignDataset(VisionDataset):
             target = self.target_transform(target)
 
         return [
-            torch.clone(img).detach(),
+            img,
             torch.tensor(target, dtype=torch.long),
         ]
 
 
+def fast_collate(batch):
+    """collate uint8 CHW images without converting to float on CPU"""
+    targets = torch.tensor([target for _, target in batch], dtype=torch.long)
+    imgs = torch.empty((len(batch),) + tuple(batch[0][0].shape),
+                       dtype=torch.uint8)
+    for i, (img, _) in enumerate(batch):
+        imgs[i].copy_(img)
+    return imgs, targets
+
+
+# (x - mean) / std rewritten as x * (1/std) + (-mean/std)
+# so it runs as a single fused multiply-add kernel
+NORM_MEAN = torch.tensor([0.5 * 255] * 3).view(1, 3, 1, 1)
+NORM_STD = torch.tensor([0.5 * 255] * 3).view(1, 3, 1, 1)
+NORM_SCALE = 1.0 / NORM_STD
+NORM_BIAS = -NORM_MEAN / NORM_STD
+
+
 class DataModule(pl.LightningDataModule):
     def __init__(self, path='./'):
         super().__init__()
@@ -138,27 +208,30 @@ class DataModule(pl.LightningDataModule):
 
     def prepare_data(self) -> None:
         #TrafficSignDataset(root=self.path, download=True)
-        self.train_transform = torchvision.transforms.Compose([
-            Resize((32, 32)),
-            ToTensor(),
-            Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
-        ])
-        self.test_transform = torchvision.transforms.Compose([
-            Resize((32, 32)),
-            ToTensor(),
-            Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
-        ])
+        # decode/crop/resize runs once here; loaders read the memmap
+        # as uint8 and on_after_batch_transfer normalizes on device
+        build_cache(self.path, train=True)
+        build_cache(self.path, train=False)
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        # uint8 batches from fast_collate get converted + normalized
+        # here, on whatever device the batch landed on (GPU or CPU)
+        imgs, targets = batch
+        if imgs.dtype == torch.uint8:
+            imgs = torch.addcmul(NORM_BIAS.to(imgs.device),
+                                 imgs.float(),
+                                 NORM_SCALE.to(imgs.device))
+        return [imgs, targets]
 
     def setup(self, stage: Optional[str] = None) -> None:
-        train = TrafficSignDataset(root=self.path,
-                                   train=True,
-                                   transform=self.train_transform)
-        self.test = TrafficSignDataset(root=self.path,
-                                       train=False,
-                                       transform=self.test_transform)
+        train = TrafficSignDataset(root=self.path, train=True)
+        self.test = TrafficSignDataset(root=self.path, train=False)
 
         # total datas count: 39209
-        self.train, self.valid = random_split(train, lengths=[34209, 5000])
+        # fixed seed so every DDP rank gets the same split
+        self.train, self.valid = random_split(
+            train, lengths=[34209, 5000],
+            generator=torch.Generator().manual_seed(42))
 
     def train_dataloader(self):
         return DataLoader(
@@ -167,24 +240,36 @@ class DataModule(pl.LightningDataModule):
             drop_last=True,
             shuffle=True,
             num_workers=NUM_WORKERS,
+            pin_memory=True,
+            persistent_workers=True,
+            prefetch_factor=4,
+            collate_fn=fast_collate,
         )
 
     def val_dataloader(self):
         return DataLoader(
             dataset=self.valid,
             batch_size=BATCH_SIZE,
-            drop_last=False,
+            drop_last=True,
             shuffle=False,
             num_workers=NUM_WORKERS,
+            pin_memory=True,
+            persistent_workers=True,
+            prefetch_factor=4,
+            collate_fn=fast_collate,
         )
 
     def test_dataloader(self):
         return DataLoader(
             dataset=self.test,
             batch_size=BATCH_SIZE,
-            drop_last=False,
+            drop_last=True,
             shuffle=False,
             num_workers=NUM_WORKERS,
+            pin_memory=True,
+            persistent_workers=True,
+            prefetch_factor=4,
+            collate_fn=fast_collate,
         )
 
 
@@ -199,17 +284,27 @@ def main():
         in_features=1280,
         out_features=FEATURES
     )
-    model = TrafficSignModel(orig_model, LEARNING_RATE)
+    orig_model = orig_model.to(memory_format=torch.channels_last)
+    # keep the eager module around: the export path below cannot handle
+    # the Dynamo OptimizedModule wrapper
+    train_model = orig_model
+    try:
+        train_model = torch.compile(orig_model, mode="reduce-overhead",
+                                    dynamic=False)
+    except Exception as e:
+        print(f"torch.compile failed, running eager: {e}")
+    model = TrafficSignModel(train_model, LEARNING_RATE, num_classes=FEATURES)
 
     trainer = pl.Trainer(
         max_epochs=NUM_EPOCHS,
         callbacks=[
-            EarlyStopping('vaild_acc', mode='max'),
+            EarlyStopping('valid_acc', mode='max', patience=5),
             ModelCheckpoint("./checkpoints"),
-            QuantizationAwareTraining()
         ],
         accelerator="auto",
         devices="auto",
+        strategy="ddp",
+        precision="bf16-mixed",
         logger=logger,
         log_every_n_steps=100
     )
@@ -219,9 +314,15 @@ def main():
 
     finish = (time() - start) / 60
     print(f"Took {finish:.3f} min")
-    quantized_model = torch.quantization.convert(model)
-    script = quantized_model.to_torchscript()
-    torch.jit.save(script, "traffic_sign_model.pt")
+
+    # post-training INT8 quantization for CPU/edge inference; quantize
+    # the eager module and save it with torch.save, since neither the
+    # compiled wrapper nor torchao's tensor subclasses can go through
+    # torch.jit.script. only rank 0 writes the file under DDP.
+    if trainer.is_global_zero:
+        orig_model = orig_model.cpu().eval()
+        quantize_(orig_model, Int8DynamicActivationInt8WeightConfig())
+        torch.save(orig_model, "traffic_sign_model.pt")
 
 
 if __name__ == '__main__':
@@ -18,7 +18,7 @@ import pytorch_lightning as pl
 
 
 class TrafficSignModel(pl.LightningModule):
-    def __init__(self, model, learning_rate):
+    def __init__(self, model, learning_rate, num_classes=43):
         super().__init__()
 
         self.learning_rate = learning_rate
@@ -26,15 +26,21 @@ class TrafficSignModel(pl.LightningModule):
 
         self.save_hyperparameters(ignore=['model'])
 
-        self.train_acc = torchmetrics.Accuracy()
-        self.valid_acc = torchmetrics.Accuracy()
-        self.test_acc = torchmetrics.Accuracy()
+        # explicit multiclass task keeps updates on device (no CPU sync)
+        self.train_acc = torchmetrics.Accuracy(
+            task="multiclass", num_classes=num_classes, compute_on_cpu=False)
+        self.valid_acc = torchmetrics.Accuracy(
+            task="multiclass", num_classes=num_classes, compute_on_cpu=False)
+        self.test_acc = torchmetrics.Accuracy(
+            task="multiclass", num_classes=num_classes, compute_on_cpu=False)
 
     def forward(self, x):
         return self.model(x)
 
     def _shared_step(self, batch):
         features, actual_labels = batch
+        # NHWC to match the channels_last model weights
+        features = features.contiguous(memory_format=torch.channels_last)
         logits = self(features)
         loss = F.cross_entropy(logits, actual_labels)
         predicted_labels = torch.argmax(logits, dim=1)
@@ -45,13 +51,9 @@ class TrafficSignModel(pl.LightningModule):
         loss, actual_labels, predicted_labels = self._shared_step(batch)
         self.log("train_loss", loss)
 
-        self.model.eval()
-        with torch.no_grad():
-            _, actual_labels, predicted_labels = self._shared_step(batch)
-        self.train_acc.update(predicted_labels, actual_labels)
+        self.train_acc.update(predicted_labels.detach(), actual_labels)
         self.log("train_acc", self.train_acc, on_epoch=True, on_step=False)
 
-        self.model.train()
         return loss
 
     def validation_step(self, batch, batch_idx):
@@ -67,5 +69,11 @@ class TrafficSignModel(pl.LightningModule):
         self.log("test_acc", self.test_acc, on_epoch=True, on_step=False)
 
     def configure_optimizers(self):
-        optimizer = torch.optim.Adam(self.parameters(), lr=self.learning_rate)
+        if torch.cuda.is_available():
+            # single fused CUDA kernel per param group
+            optimizer = torch.optim.Adam(
+                self.parameters(), lr=self.learning_rate, fused=True)
+        else:
+            optimizer = torch.optim.Adam(
+                self.parameters(), lr=self.learning_rate, foreach=True)
         return optimizer
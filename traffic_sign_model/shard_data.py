@@ -0,0 +1,56 @@
+
+
+import io
+import os
+import tarfile
+
+import pandas as pd
+
+
+SHARD_BYTES = 256 * 1024 * 1024  # ~256MB per shard
+
+
+def write_shards(root='./datasets', ds='Train'):
+    """pack the per-sample image files into WebDataset-style tar shards
+
+    Each sample becomes a {idx}.jpg + {idx}.cls pair so the shards can
+    be read with wds.WebDataset("train-{00000..000NN}.tar") as large
+    sequential reads instead of one small-file seek per sample.
+    """
+    df = pd.read_csv(os.path.join(root, ds + '.csv'))
+    paths = df['Path'].to_numpy()
+    cids = df['ClassId'].to_numpy()
+
+    shard = 0
+    written = 0
+    tar = tarfile.open(
+        os.path.join(root, f'{ds.lower()}-{shard:05d}.tar'), 'w')
+
+    for i in range(paths.shape[0]):
+        if written >= SHARD_BYTES:
+            tar.close()
+            shard += 1
+            written = 0
+            tar = tarfile.open(
+                os.path.join(root, f'{ds.lower()}-{shard:05d}.tar'), 'w')
+
+        img_path = os.path.join(root, paths[i])
+        tar.add(img_path, arcname=f'{i}.jpg')
+        written += os.path.getsize(img_path)
+
+        cls = str(cids[i]).encode()
+        info = tarfile.TarInfo(f'{i}.cls')
+        info.size = len(cls)
+        tar.addfile(info, io.BytesIO(cls))
+
+    tar.close()
+    print(f'{ds}: wrote {shard + 1} shard(s)')
+
+
+def main():
+    for ds in ['Test', 'Train']:
+        write_shards(ds=ds)
+
+
+if __name__ == '__main__':
+    main()